@@ -0,0 +1,113 @@
+#
+# Append only, compressed cold storage for the db rows of departed
+# and idle members
+#
+import os
+import json
+import zlib
+import struct
+
+# user id, length of the compressed rows that follow (0 when restored)
+HEADER = struct.Struct('<QI')
+
+class Archive:
+    """
+    A file of records each holding every db row of one user as
+    zlib compressed json.  A later record for a user replaces the
+    earlier one, and an empty record means they were restored.
+    Only an index of user id to record offset is kept in memory.
+    """
+    def __init__(self, path):
+        self.path = path
+        self.index = dict()
+        # bytes taken by records that have been replaced
+        self.dead = 0
+        self.scan()
+
+    def __contains__(self, uid):
+        return uid in self.index
+
+    def __len__(self):
+        return len(self.index)
+
+    def size(self):
+        """ bytes on disk """
+        try:
+            return os.path.getsize(self.path)
+        except OSError:
+            return 0
+
+    def scan(self):
+        """ build the index, cutting off any record torn by a crash """
+        self.index = dict()
+        self.dead = 0
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, 'r+b') as f:
+            pos = 0
+            while True:
+                head = f.read(HEADER.size)
+                if len(head) < HEADER.size:
+                    break
+                (uid, length) = HEADER.unpack(head)
+                if len(f.read(length)) < length:
+                    break
+                if uid in self.index:
+                    self.dead += HEADER.size + self.index[uid][1]
+                if length:
+                    self.index[uid] = (pos, length)
+                else:
+                    self.index.pop(uid, None)
+                    self.dead += HEADER.size
+                pos += HEADER.size + length
+            f.truncate(pos)
+
+    def append(self, records):
+        """ write (uid, payload) records in one go """
+        with open(self.path, 'ab') as f:
+            pos = f.tell()
+            for uid, payload in records:
+                f.write(HEADER.pack(uid, len(payload)) + payload)
+                if uid in self.index:
+                    self.dead += HEADER.size + self.index[uid][1]
+                if payload:
+                    self.index[uid] = (pos, len(payload))
+                else:
+                    self.index.pop(uid, None)
+                    self.dead += HEADER.size
+                pos += HEADER.size + len(payload)
+            f.flush()
+            os.fsync(f.fileno())
+
+    def put(self, rows):
+        """ store {uid: {table: doc}} """
+        self.append([(uid, zlib.compress(json.dumps(tables).encode())) for uid, tables in rows.items()])
+
+    def get(self, uid):
+        """ the {table: doc} stored for a user, or None """
+        if uid not in self.index:
+            return None
+        (pos, length) = self.index[uid]
+        with open(self.path, 'rb') as f:
+            f.seek(pos + HEADER.size)
+            return json.loads(zlib.decompress(f.read(length)))
+
+    def drop(self, uids):
+        """ forget users that have been restored """
+        self.append([(uid, b'') for uid in uids if uid in self.index])
+
+    def compact(self):
+        """ rewrite with only the live records, returns the bytes reclaimed """
+        before = self.size()
+        if not self.dead:
+            return 0
+        tmp = self.path + '.tmp'
+        with open(self.path, 'rb') as src, open(tmp, 'wb') as dst:
+            for uid, (pos, length) in self.index.items():
+                src.seek(pos)
+                dst.write(src.read(HEADER.size + length))
+            dst.flush()
+            os.fsync(dst.fileno())
+        os.replace(tmp, self.path)
+        self.scan()
+        return before - self.size()
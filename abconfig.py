@@ -12,3 +12,17 @@ token = ''
 
 # prefix for database filenames
 db_prefix = '/home/ubuntu/bots/alicebot/db_'
+
+# state saved on shutdown for a quick warm restart
+snapshot = '/home/ubuntu/bots/alicebot/alicebot.snapshot'
+
+# keep a compact member table instead of caching every member,
+# for very large servers
+low_memory = False
+
+# how many jobs of each class may run at once across all servers
+job_quotas = {'interactive': 8, 'background': 2, 'bulk': 2}
+
+# share of each job class a server gets when servers are queuing, by
+# guild id, either one weight or {class: weight}; servers not listed get 1
+guild_weights = {}
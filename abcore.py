@@ -0,0 +1,495 @@
+#
+# State and helpers shared by ALiceBot and all of its command modules.
+# This is never reloaded, so everything in here survives a .reload
+#
+import os
+import ast
+import time
+import math
+import re
+import discord
+from tinydb import Query
+from datetime import timedelta
+from datetime import datetime
+from datetime import timezone
+from mee6_py_api import API
+import abconfig
+import absnapshot
+import abmembers
+import abarchive
+
+known_config = ( ('invite_cooldown', 'interval'),
+                 ('invite_timespan', 'interval'),
+                 ('autokick_hasrole', 'role'),
+                 ('autokick_timelimit', 'interval'),
+                 ('autokick_reason', 'string'),
+                 ('log_channel', 'channel'),
+                 ('announce_arrive', 'channel'),
+                 ('announce_leave', 'channel'),
+                 ('archive_idle', 'interval'),
+               )
+
+# db tables that are cached in botconfig
+config_sections = ('config', 'access', 'dict', 'convert')
+
+# db tables with a row per user, moved to the archive when they go cold
+member_tables = ('info', 'invite', 'PingCount')
+
+db = dict()
+botconfig = dict()
+archives = dict()
+warm = None
+# periodic job name -> when it was next due, carried over a .reload
+next_runs = dict()
+
+logpath = os.path.dirname(os.path.realpath(__file__))
+logfile = logpath + '/alicebot.log'
+
+def isfloat(a):
+    """ Is the argument a floating point number"""
+    try:
+        float(a)
+        return True
+    except ValueError:
+        pass
+    return False
+
+# what a conversion formula may be made of, arithmetic on x and numbers
+formula_nodes = (ast.Expression, ast.BinOp, ast.UnaryOp, ast.Constant, ast.Name, ast.Load,
+                 ast.Add, ast.Sub, ast.Mult, ast.Div, ast.FloorDiv, ast.Mod, ast.Pow,
+                 ast.UAdd, ast.USub)
+
+def isformula(a):
+    """ is the argument only arithmetic on x and numbers """
+    try:
+        tree = ast.parse(a, mode='eval')
+    except SyntaxError:
+        return False
+    for node in ast.walk(tree):
+        if not isinstance(node, formula_nodes):
+            return False
+        if isinstance(node, ast.Name) and node.id != 'x':
+            return False
+        if isinstance(node, ast.Constant) and (isinstance(node.value, bool) or not isinstance(node.value, (int, float))):
+            return False
+        # powers of whole numbers can take forever, x (a float) keeps them quick
+        if isinstance(node, ast.BinOp) and isinstance(node.op, ast.Pow) and not uses_x(node):
+            return False
+    return True
+
+def uses_x(node):
+    """ does part of a formula depend on x """
+    return any(isinstance(n, ast.Name) for n in ast.walk(node))
+
+def isexpression(a):
+    """ does the argument contain a valid expression """
+    if 'x' not in a:
+        return False
+    if not isformula(a):
+        print("Not a formula: %s" % a)
+        return False
+    try:
+        res = eval(a, {'__builtins__': {}, 'x': 1.0})
+        return True
+    except SyntaxError as err:
+        print("SyntaxError +%d: %s" % (err.offset, err.text))
+    except NameError as err:
+        print("Var not found: %s" % err)
+    return False
+
+def find_config(name):
+    """ look up a name in the known configs """
+    for config in known_config:
+        if config[0] == name:
+            return config
+    return None
+
+def has_role(member, roleid):
+    """ test for role id in members role list """
+    if any(r.id == roleid for r in member.roles):
+        return True
+    return False
+
+async def guild_members(guild):
+    """
+    every member of a guild, in low memory mode paged in from discord
+    which also rebuilds the compact member table
+    """
+    if not abconfig.low_memory:
+        for mem in guild.members:
+            yield mem
+        return
+    table = abmembers.MemberTable([r.id for r in guild.roles])
+    async for mem in guild.fetch_members(limit=None):
+        joined = mem.joined_at.timestamp() if mem.joined_at else 0
+        table.append(mem.id, joined, [r.id for r in mem.roles])
+        yield mem
+    table.sort()
+    abmembers.tables[guild.id] = table
+    log(guild, None, "Member table holds {} members in {} bytes".format(len(table), table.nbytes()))
+
+async def members_refresh(guild, slot=None):
+    """
+    rebuild the compact member table in low memory mode, giving way
+    to other guilds now and then when run as a scheduled job
+    """
+    count = 0
+    async for mem in guild_members(guild):
+        count += 1
+        if slot and count % 1000 == 0:
+            await slot.pause()
+
+def members_with_role(guild, roleid):
+    """ yield (member, name, joined) for everyone holding the role """
+    if not abconfig.low_memory:
+        for member in guild.members:
+            if has_role(member, roleid):
+                yield (member, member.display_name, member.joined_at)
+        return
+    table = abmembers.tables.get(guild.id)
+    if not table:
+        return
+    for uid, joined in table.with_role(roleid):
+        yield (discord.Object(id=uid), "[{}]".format(uid), datetime.fromtimestamp(joined, timezone.utc))
+
+def timestr(secs):
+    """ print number of seconds as a human readable value """
+    if secs > 86400:
+        days = math.floor(secs / 86400)
+        secs = secs - 86400 * days
+        hours = math.floor( secs / 3600 )
+        return "{}d {}h".format(days, hours)
+    elif secs > 3600:
+        hours = math.floor( secs / 3600 )
+        secs = secs - 3600 * hours
+        mins = math.floor( secs / 60 )
+        return "{}h {}m".format(hours, mins)
+    elif secs > 60:
+        mins = math.floor( secs / 60 )
+        secs = secs - 60 * mins
+        return "{}m {}s".format(mins, secs)
+    else:
+        return "{}s".format(secs)
+
+def timespan(secs):
+    """ print a timespan as an approximation """
+    if secs > 2592000 * 2:  # Assume 30 days in a month
+        """ over two months ago """
+        months = math.floor( secs / 2592000 )
+        return "{} months".format(months)
+    elif secs > 86400 * 2:
+        days = math.floor(secs / 86400)
+        return "{} days".format(days)
+    elif secs > 3600 * 2:
+        hours = math.floor( secs / 3600 )
+        return "{} hours".format(hours)
+    elif secs >= 60 * 2:
+        mins = math.floor( secs / 60 )
+        return "{} minutes".format(mins)
+    else:
+        return "{} seconds".format(math.floor(secs))
+
+def timesince(when):
+    """ time since the given timestamp string """
+    today = datetime.utcnow()
+    event = parse_date(when)
+    diff = today - event
+    return timespan( diff.total_seconds() )
+
+def parse_date(strtime):
+    try:
+        when = datetime.strptime(strtime, '%Y-%m-%d %H:%M:%S.%f')
+        return when
+    except ValueError:
+        pass
+    # discord.py 2 times are timezone aware, and str() adds +00:00
+    try:
+        when = datetime.fromisoformat(strtime)
+    except ValueError:
+        return None
+    if when.tzinfo:
+        when = when.astimezone(timezone.utc).replace(tzinfo=None)
+    return when
+
+regex = re.compile(r'^((?P<days>[\.\d]+?)d)?((?P<hours>[\.\d]+?)h)?((?P<minutes>[\.\d]+?)m)?((?P<seconds>[\.\d]+?)s)?$')
+
+def parse_interval(time_str):
+    """ parse human readable interval into a timedelta """
+    parts = regex.match(time_str)
+    if parts is None:
+        return None
+    time_params = {name: float(param) for name, param in parts.groupdict().items() if param}
+    return timedelta(**time_params)
+
+def parse_when(when_str):
+    """ parse an interval ago or a date/time into epoch seconds """
+    delta = parse_interval(when_str)
+    if delta is not None:
+        return time.time() - delta.total_seconds()
+    for fmt in ('%Y-%m-%d %H:%M:%S', '%Y-%m-%d %H:%M', '%Y-%m-%d'):
+        try:
+            return time.mktime(time.strptime(when_str.replace('T', ' '), fmt))
+        except ValueError:
+            pass
+    return None
+
+def log(guild, channel, text):
+    """ write an entry to the logfile """
+    path = logfile
+    if not guild:
+        gid = '-'
+    else:
+        gid = str(guild.id)
+    if not channel:
+        channel = '-'
+    when = time.strftime('%b %d %Y %H:%M:%S')
+    with open(path, 'a') as f:
+        f.write("{} {} {} {}\n".format(when, gid, channel, text))
+
+def config_read(guild, section):
+    """
+    Private function to turn a db table of config into a dict
+    """
+    tab = db[guild.id].table(section)
+    out = dict()
+    for r in tab.all():
+        out[ r['key'] ] = r['value']
+    return out
+
+def db_path(gid):
+    """ filename of the db for a guild """
+    return abconfig.db_prefix + str(gid) + '.json'
+
+def config_load(guild, snap=None):
+    """
+    Reload all the configuration fr this guild, taking it from a
+    warm restart snapshot if the db has not changed since it was made
+    """
+    global botconfig
+    botconfig[guild.id] = dict()
+    if snap and snap['generation'] == absnapshot.generation(db_path(guild.id)):
+        for section in config_sections:
+            botconfig[guild.id][section] = snap[section]
+    else:
+        for section in config_sections:
+            botconfig[guild.id][section] = config_read(guild, section)
+    botconfig[guild.id]['mee6'] = API(guild.id)
+    # unflushed message times are still pending even if the db moved on
+    if snap:
+        botconfig[guild.id]['last_msg'] = snap['last_msg']
+    else:
+        botconfig[guild.id]['last_msg'] = dict()
+
+def snapshot_save():
+    """
+    Write out the in memory state for a quick warm restart
+    """
+    state = dict()
+    state['guilds'] = dict()
+    for gid, conf in botconfig.items():
+        if gid in db:
+            db[gid].close()
+        snap = dict()
+        snap['generation'] = absnapshot.generation(db_path(gid))
+        for section in config_sections:
+            snap[section] = conf[section]
+        snap['last_msg'] = conf['last_msg']
+        state['guilds'][gid] = snap
+    absnapshot.save(abconfig.snapshot, state)
+    log(None, None, "Saved warm restart snapshot of {} guilds".format(len(state['guilds'])))
+
+def snapshot_load():
+    """
+    Pick up the snapshot left by the last clean shutdown, if any
+    """
+    global warm
+    warm = absnapshot.load(abconfig.snapshot)
+    if not warm:
+        log(None, None, "No warm restart snapshot, cold start")
+        return
+    log(None, None, "Loaded warm restart snapshot of {} guilds".format(len(warm['guilds'])))
+
+def config_set(guild, section, key, value):
+    """
+    Set a single value of config then reload the dicts
+    """
+    global botconfig
+    tab = db[guild.id].table(section)
+    query = Query()
+    if not value:
+        tab.remove(query.key == key)
+    else:
+        tab.upsert({'key': key, 'value': value}, query.key == key)
+    botconfig[guild.id][section] = config_read(guild, section)
+
+def config_set_many(guild, section, entries):
+    """
+    Set many values of config at once, a value of None removes the key.
+    The db is written once however many there are, so either all of
+    them are applied or none, and the cached dict is updated in place
+    rather than re-read
+    """
+    tab = db[guild.id].table(section)
+
+    def apply(docs):
+        found = {doc.get('key'): doc_id for doc_id, doc in docs.items()}
+        for key, value in entries.items():
+            if key in found:
+                if value:
+                    docs[found[key]]['value'] = value
+                else:
+                    del docs[found[key]]
+            elif value:
+                docs[tab._get_next_id()] = {'key': key, 'value': value}
+
+    tab._update_table(apply)
+    cache = botconfig[guild.id][section]
+    for key, value in entries.items():
+        if value:
+            cache[key] = value
+        else:
+            cache.pop(key, None)
+
+def config_get(guild, section, key, type='string'):
+    """
+    fetch a single config value
+    """
+    global botconfig
+    if not guild.id in botconfig:
+        return None
+    if not section in botconfig[guild.id]:
+        return None
+    if not key in botconfig[guild.id][section]:
+        return None
+    answer = botconfig[guild.id][section][key]
+    if type == 'interval':
+        answer = parse_interval(answer)
+    elif type == 'role':
+        answer = guild.get_role(answer)
+    elif type == 'channel':
+        answer = guild.get_channel(answer)
+    return answer
+
+def db_get(guild, user, table, key):
+    """ lookup a config value for this guild """
+    tab = db[guild.id].table(table)
+    query = Query()
+    res = tab.search((query.uid == user.id))
+    if not res and archive_restore(guild, user.id):
+        res = tab.search((query.uid == user.id))
+    if res and key in res[0]:
+        answer = res[0][key]
+    else:
+        answer = None
+    return answer
+
+def db_set(guild, user, table, key, value):
+    archive = archive_get(guild)
+    if user.id in archive:
+        # leave them archived, only writing a new record if this changes it
+        rows = archive.get(user.id)
+        doc = rows.setdefault(table, {'uid': user.id})
+        if doc.get(key) != value:
+            doc[key] = value
+            archive.put({user.id: rows})
+        return
+    tab = db[guild.id].table(table)
+    query = Query()
+    tab.upsert({'uid': user.id, key: value}, query.uid == user.id)
+
+def archive_get(guild):
+    """ the cold archive for a guild, opened on first use """
+    if guild.id not in archives:
+        archives[guild.id] = abarchive.Archive(abconfig.db_prefix + str(guild.id) + '.archive')
+    return archives[guild.id]
+
+def archive_members(guild, uids):
+    """
+    Move every row these users have in the member tables out of the
+    db and into the archive, returns how many users were moved
+    """
+    wanted = set(uids)
+    if not wanted:
+        return 0
+    query = Query()
+    rows = dict()
+    for table in member_tables:
+        for doc in db[guild.id].table(table).search(query.uid.test(lambda uid: uid in wanted)):
+            rows.setdefault(doc['uid'], dict())[table] = dict(doc)
+    if not rows:
+        return 0
+    # safely in the archive before it leaves the db
+    archive_get(guild).put(rows)
+    for table in member_tables:
+        db[guild.id].table(table).remove(query.uid.test(lambda uid: uid in rows))
+    return len(rows)
+
+def archive_restore(guild, uid):
+    """
+    Move a users rows back from the archive, True if there were any
+    """
+    archive = archive_get(guild)
+    if uid not in archive:
+        return False
+    query = Query()
+    for table, doc in archive.get(uid).items():
+        db[guild.id].table(table).upsert(doc, query.uid == uid)
+    archive.drop([uid])
+    return True
+
+def archive_idle(guild, cutoff):
+    """
+    Archive everyone whose last message, or join if they never spoke,
+    was before the cutoff (naive utc), returns how many were moved
+    """
+    uids = []
+    for doc in db[guild.id].table('info').all():
+        when = doc.get('lastmsg') or doc.get('joined')
+        if when and when != 'None':
+            when = parse_date(when)
+            if when and when < cutoff:
+                uids.append(doc['uid'])
+    return archive_members(guild, uids)
+
+def perm_check(ctx, need):
+    answer = False
+    reason = "None"
+    
+    # is there a configured level (ignore admin only ones)
+    level = config_get(ctx.guild, "access", ctx.invoked_with)
+    if need != 0 and level:
+        need = level
+
+    # a public command
+    if not need and need != 0:
+        answer = True
+        reason = "Public"
+
+    # you were an admin anyway
+    elif ctx.channel.permissions_for(ctx.author).administrator:
+        answer = True
+        reason = "Admin"
+
+    # you have the corresponding role
+    elif has_role(ctx.author, need):
+        answer = True
+        reason = "Match"
+
+    log(ctx.guild, ctx.channel, "perm_check({},{}) = {}".format(ctx.invoked_with, need, reason))
+    return answer
+
+def convert_makekey(unit, subunit):
+    if subunit:
+        return "{}|{}".format(unit,subunit)
+    else:
+        return "{}".format(unit)
+
+def convert_splitkey(key):
+    unit = None
+    sub = None
+    if key:
+        parts = key.split('|')
+        unit = parts[0]
+        if len(parts) > 1:
+            sub = parts[1]
+    return (unit,sub)
@@ -0,0 +1,119 @@
+#
+# Pools of ready made single use invites for the .invite command
+#
+import math
+import asyncio
+from collections import deque
+
+# a pooled invite is handed out while it still has this much of its life left
+FRESH = 0.9
+# never keep more than this many spare invites per channel
+POOL_MAX = 5
+# demand is counted over this many seconds, and a pool with no demand
+# in that time is left to drain
+DEMAND_WINDOW = 3600
+
+# (guild id, channel id) -> InvitePool
+pools = dict()
+# refills started by .invite, held until they finish so they are not
+# garbage collected part way through
+refills = set()
+
+class InvitePool:
+    """
+    Spare invites for one channel, all created with the same max_age,
+    plus the invites already handed out and how many have been asked for
+    """
+    def __init__(self, timespan):
+        self.timespan = timespan
+        # (created, invite) oldest first
+        self.spare = deque()
+        # invite code -> (user id, expires)
+        self.issued = dict()
+        self.demand = deque()
+        self.expired = 0
+        self.lock = asyncio.Lock()
+
+    def __len__(self):
+        return len(self.spare)
+
+    def add(self, invite, now):
+        """ a freshly created invite """
+        self.spare.append((now, invite))
+
+    def take(self, now, timespan):
+        """
+        return (invite, seconds it remains valid) for the oldest invite
+        that is still fresh enough, so that fewer go stale unused, or
+        None if there is none
+        """
+        self.demand.append(now)
+        if timespan != self.timespan:
+            # made for the old invite_timespan, retire will clear them
+            return None
+        for item in self.spare:
+            (created, invite) = item
+            remain = created + self.timespan - now
+            # too old ones are left for retire to delete
+            if remain >= self.timespan * FRESH:
+                self.spare.remove(item)
+                return (invite, remain)
+        return None
+
+    def put_back(self, invite, created):
+        """ an invite that could not be delivered """
+        self.spare.append((created, invite))
+
+    def record(self, invite, uid, now):
+        """ remember who an invite went to until it expires """
+        self.issued[invite.code] = (uid, now + invite.max_age)
+
+    def retire(self, now, timespan):
+        """
+        drop spare invites too old to hand out, or all of them if
+        invite_timespan has changed, and forget expired issued ones.
+        Returns the invites that should be deleted from discord.
+        """
+        stale = []
+        if timespan != self.timespan:
+            self.timespan = timespan
+            stale = [invite for (created, invite) in self.spare]
+            self.spare.clear()
+        while self.spare and self.spare[0][0] + self.timespan * (1 - FRESH) < now:
+            stale.append(self.spare.popleft()[1])
+        self.expired += len(stale)
+        for code in [code for code, (uid, expires) in self.issued.items() if expires <= now]:
+            del self.issued[code]
+        while self.demand and self.demand[0] < now - DEMAND_WINDOW:
+            self.demand.popleft()
+        return stale
+
+    def discard(self, code):
+        """ an invite was deleted outside the bot """
+        for item in self.spare:
+            if item[1].code == code:
+                self.spare.remove(item)
+                self.expired += 1
+                return
+        self.issued.pop(code, None)
+
+    def target(self, now):
+        """
+        how many spare invites to keep: only as many as the last hours
+        demand would use up while they are fresh, so that spares are
+        rarely thrown away, and none for a quiet channel
+        """
+        if not self.demand:
+            return 0
+        recent = sum(1 for when in self.demand if when > now - DEMAND_WINDOW)
+        # invites are only fresh for so long, cover the demand in that time
+        life = min(self.timespan * (1 - FRESH), DEMAND_WINDOW)
+        wanted = math.floor(recent * life / DEMAND_WINDOW)
+        return min(wanted, POOL_MAX)
+
+def get_pool(guild_id, channel_id, timespan):
+    """ find or make the pool for a channel """
+    key = (guild_id, channel_id)
+    if key not in pools:
+        pools[key] = InvitePool(timespan)
+    return pools[key]
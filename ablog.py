@@ -0,0 +1,210 @@
+#
+# Time indexed search of the ALiceBot logfile
+#
+import os
+import glob
+import mmap
+import time
+import bisect
+import threading
+
+# every line starts 'Oct 19 2026 12:34:56 '
+STAMP_FORMAT = '%b %d %Y %H:%M:%S'
+STAMP_LEN = 20
+
+# take one index sample per this many bytes of log
+INDEX_STRIDE = 64 * 1024
+
+# rotated segments we cannot mmap
+COMPRESSED = ('.gz', '.bz2', '.xz', '.zst')
+
+segments = dict()
+lock = threading.Lock()
+
+def parse_stamp(line):
+    """ epoch seconds of the timestamp that starts a log line, or None """
+    try:
+        return time.mktime(time.strptime(line[:STAMP_LEN].decode(), STAMP_FORMAT))
+    except (ValueError, UnicodeDecodeError):
+        return None
+
+def line_start(mm, pos):
+    """ offset of the first line that starts at or after pos """
+    if pos == 0:
+        return 0
+    nl = mm.find(b'\n', pos - 1)
+    if nl < 0:
+        return len(mm)
+    return nl + 1
+
+def next_line(mm, pos):
+    """ return (line, offset of the following line) """
+    nl = mm.find(b'\n', pos)
+    if nl < 0:
+        return (mm[pos:], len(mm))
+    return (mm[pos:nl], nl + 1)
+
+class Segment:
+    """
+    One log file (current or rotated) and a sparse index of
+    (timestamp, offset) samples taken every INDEX_STRIDE bytes.
+    Keyed by inode so a rename during rotation keeps the index, and
+    checked against the file before each use in case it was truncated
+    and rewritten (copytruncate) or the inode was reused.
+    """
+    def __init__(self, path):
+        self.path = path
+        self.size = 0
+        self.stamps = []
+        self.offsets = []
+
+    def matches(self, mm):
+        """ do the first and last samples still point at the lines they were taken from """
+        for i in (0, -1):
+            offset = self.offsets[i]
+            if offset >= len(mm) or line_start(mm, offset) != offset:
+                return False
+            stamp = parse_stamp(next_line(mm, offset)[0])
+            if stamp is None or stamp > self.stamps[i]:
+                return False
+            # later samples may have been raised to keep the index monotonic
+            if i == 0 and stamp != self.stamps[0]:
+                return False
+        return True
+
+    def refresh(self, mm):
+        """ extend the index over anything appended since the last call """
+        size = len(mm)
+        if size < self.size or (self.offsets and not self.matches(mm)):
+            # truncated or replaced, start again
+            self.stamps = []
+            self.offsets = []
+        self.size = size
+        if self.offsets:
+            pos = self.offsets[-1] + INDEX_STRIDE
+        else:
+            pos = 0
+        while pos < size:
+            start = line_start(mm, pos)
+            stamp = None
+            while start < size and stamp is None:
+                line, after = next_line(mm, start)
+                stamp = parse_stamp(line)
+                if stamp is None:
+                    start = after
+            if stamp is None:
+                break
+            # clock changes must not break the bisect, keep it monotonic
+            if self.stamps and stamp < self.stamps[-1]:
+                stamp = self.stamps[-1]
+            self.stamps.append(stamp)
+            self.offsets.append(start)
+            pos = start + INDEX_STRIDE
+
+    def seek(self, since):
+        """ offset at or before the first line logged at since """
+        if not since or not self.stamps:
+            return 0
+        i = bisect.bisect_left(self.stamps, since) - 1
+        return self.offsets[max(i, 0)]
+
+def open_segments(path):
+    """
+    mmap the logfile and its rotated copies, returning a list of
+    (Segment, mmap) ordered oldest first
+    """
+    found = list()
+    seen = set()
+    for name in glob.glob(path + '*'):
+        if name.endswith(COMPRESSED) or not os.path.isfile(name):
+            continue
+        try:
+            f = open(name, 'rb')
+        except OSError:
+            continue
+        with f:
+            st = os.fstat(f.fileno())
+            if st.st_size == 0:
+                continue
+            mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        key = (st.st_dev, st.st_ino)
+        seen.add(key)
+        if key not in segments:
+            segments[key] = Segment(name)
+        seg = segments[key]
+        seg.path = name
+        seg.refresh(mm)
+        if not seg.stamps:
+            mm.close()
+            continue
+        found.append((seg, mm))
+    # forget files that have been deleted or emptied
+    for key in [key for key in segments if key not in seen]:
+        del segments[key]
+    found.sort(key=lambda s: s[0].stamps[0])
+    return found
+
+def search(path, since=None, until=None, guild=None, channel=None, text=None, limit=500):
+    """
+    Find log lines between since and until (epoch seconds) that match
+    the guild id, channel name and text filters.  Returns
+    (lines, truncated) with the lines oldest first.
+    """
+    if guild is not None:
+        guild = str(guild).encode()
+    if channel is not None:
+        channel = channel.encode()
+    if text:
+        text = text.lower().encode()
+
+    out = list()
+    truncated = False
+    with lock:
+        found = open_segments(path)
+        try:
+            for i, (seg, mm) in enumerate(found):
+                # the next segment starts after this one ends
+                if since and i + 1 < len(found) and found[i + 1][0].stamps[0] < since:
+                    continue
+                if until and seg.stamps[0] > until:
+                    break
+                pos = seg.seek(since)
+                stamp = None
+                head = None
+                while pos < len(mm):
+                    line, pos = next_line(mm, pos)
+                    entry = parse_stamp(line)
+                    if entry is not None:
+                        stamp = entry
+                        parts = line[STAMP_LEN + 1:].split(b' ', 2)
+                        if len(parts) < 3:
+                            head = None
+                            continue
+                        head = parts[:2]
+                        body = parts[2]
+                    else:
+                        # lines that do not start with a timestamp continue the
+                        # previous entry, and share its time, guild and channel
+                        body = line
+                    if stamp is None or head is None:
+                        continue
+                    if since and stamp < since:
+                        continue
+                    if until and stamp > until:
+                        break
+                    if guild is not None and head[0] != guild:
+                        continue
+                    if channel is not None and head[1] != channel:
+                        continue
+                    if text and text not in body.lower():
+                        continue
+                    if len(out) >= limit:
+                        truncated = True
+                        break
+                    out.append(line.decode('utf-8', 'replace'))
+                if truncated:
+                    break
+        finally:
+            for (seg, mm) in found:
+                mm.close()
+    return (out, truncated)
@@ -0,0 +1,117 @@
+#
+# Compact member table for the low memory member caching mode
+#
+import bisect
+from array import array
+
+# guild id -> MemberTable
+tables = dict()
+
+class MemberTable:
+    """
+    Every member of one guild as parallel arrays sorted by user id:
+    the id, when they joined (epoch seconds) and a bitmap of their
+    roles, 'words' 64 bit words per member.  Around 40 bytes a member
+    instead of a full discord.Member.
+    """
+    def __init__(self, role_ids=()):
+        # role id -> bit number, roles created after the build are not tracked
+        self.bits = {rid: bit for bit, rid in enumerate(role_ids)}
+        self.words = max(1, (len(self.bits) + 63) // 64)
+        self.ids = array('Q')
+        self.joined = array('d')
+        self.roles = array('Q')
+
+    def __len__(self):
+        return len(self.ids)
+
+    def nbytes(self):
+        """ memory used by the arrays """
+        return sum(a.itemsize * len(a) for a in (self.ids, self.joined, self.roles))
+
+    def pack(self, role_ids):
+        """ role ids to a list of bitmap words """
+        bitmap = 0
+        for rid in role_ids:
+            bit = self.bits.get(rid)
+            if bit is not None:
+                bitmap |= 1 << bit
+        return [(bitmap >> (64 * w)) & 0xffffffffffffffff for w in range(self.words)]
+
+    def append(self, uid, joined, role_ids):
+        """ add a member to the end while building, sort() once done """
+        self.ids.append(uid)
+        self.joined.append(joined)
+        self.roles.extend(self.pack(role_ids))
+
+    def sort(self):
+        """
+        put appended members in user id order, dropping any duplicates,
+        by sorting row numbers rather than the rows themselves
+        """
+        order = sorted(range(len(self.ids)), key=self.ids.__getitem__)
+        (ids, joined, roles) = (self.ids, self.joined, self.roles)
+        self.ids = array('Q')
+        self.joined = array('d')
+        self.roles = array('Q')
+        for row in order:
+            if self.ids and self.ids[-1] == ids[row]:
+                continue
+            self.ids.append(ids[row])
+            self.joined.append(joined[row])
+            self.roles.extend(roles[row * self.words:(row + 1) * self.words])
+
+    def find(self, uid):
+        """ row number of a user, or None """
+        row = bisect.bisect_left(self.ids, uid)
+        if row < len(self.ids) and self.ids[row] == uid:
+            return row
+        return None
+
+    def add(self, uid, joined, role_ids):
+        """ add or replace one member """
+        words = self.pack(role_ids)
+        row = self.find(uid)
+        if row is not None:
+            self.joined[row] = joined
+            self.roles[row * self.words:(row + 1) * self.words] = array('Q', words)
+            return
+        row = bisect.bisect_left(self.ids, uid)
+        self.ids.insert(row, uid)
+        self.joined.insert(row, joined)
+        self.roles[row * self.words:row * self.words] = array('Q', words)
+
+    def remove(self, uid):
+        """ drop a member that left """
+        row = self.find(uid)
+        if row is None:
+            return
+        del self.ids[row]
+        del self.joined[row]
+        del self.roles[row * self.words:(row + 1) * self.words]
+
+    def get_joined(self, uid):
+        """ when a member joined, or None """
+        row = self.find(uid)
+        if row is None:
+            return None
+        return self.joined[row]
+
+    def has_role(self, uid, roleid):
+        """ test for role id in a members bitmap """
+        row = self.find(uid)
+        bit = self.bits.get(roleid)
+        if row is None or bit is None:
+            return False
+        return bool(self.roles[row * self.words + bit // 64] >> (bit % 64) & 1)
+
+    def with_role(self, roleid):
+        """ yield (uid, joined) of every member holding the role """
+        bit = self.bits.get(roleid)
+        if bit is None:
+            return
+        word = bit // 64
+        mask = 1 << (bit % 64)
+        for row in range(len(self.ids)):
+            if self.roles[row * self.words + word] & mask:
+                yield (self.ids[row], self.joined[row])
@@ -0,0 +1,201 @@
+#
+# Live profiling of the running bot
+#
+import io
+import sys
+import time
+import pstats
+import asyncio
+import cProfile
+import threading
+import tracemalloc
+from collections import Counter
+
+# the sampler backs off to stay under this fraction of one cpu
+MAX_OVERHEAD = 0.01
+SAMPLE_INTERVAL = 0.01
+# how often the event loop proves it is still turning
+HEARTBEAT = 0.05
+# deepest stack kept for a sample
+MAX_DEPTH = 64
+# nothing runs longer than this, cProfile has no overhead cap of its own
+MAX_LIMIT = 30 * 60
+MAX_CPROFILE_LIMIT = 5 * 60
+# stop tracing allocations if tracemalloc itself grows past this
+MAX_TRACE_MEMORY = 64 * 1024 * 1024
+
+def collapse(frame):
+    """ a stack as 'file:func:line;...' outermost first, for flamegraph.pl """
+    names = []
+    while frame is not None and len(names) < MAX_DEPTH:
+        code = frame.f_code
+        names.append("{}:{}:{}".format(code.co_filename.rsplit('/', 1)[-1], code.co_name, frame.f_lineno))
+        frame = frame.f_back
+    return ';'.join(reversed(names))
+
+class Profiler:
+    """
+    Sampling (or cProfile) cpu profile, tracemalloc allocation diff and
+    event loop stall detection, all switched on and off together
+    """
+    def __init__(self):
+        self.running = False
+        self.started = None
+        self.stopped = None
+        self.notes = []
+        self.cpu = None
+        self.samples = Counter()
+        # stack -> seconds seen while the loop was stalled
+        self.stalls = Counter()
+        self.stall_count = 0
+        self.cprofile = None
+        self.baseline = None
+        self.final = None
+        self.lock = threading.Lock()
+
+    def start(self, cpu='sample', memory=False, slow=0.1, limit=300):
+        """ start profiling the calling thread, which must be running the event loop """
+        if self.running:
+            return False
+        if cpu == 'cprofile':
+            limit = min(limit, MAX_CPROFILE_LIMIT)
+        limit = min(limit, MAX_LIMIT)
+        self.__init__()
+        self.running = True
+        self.started = time.time()
+        self.cpu = cpu
+        self.slow = slow
+        self.interval = SAMPLE_INTERVAL
+        self.sampled_time = 0.0
+        self.main_id = threading.get_ident()
+        self.heartbeat = time.monotonic()
+        self.halt = threading.Event()
+
+        loop = asyncio.get_running_loop()
+        self.deadline = loop.call_later(limit, self.stop, "time limit of {}s reached".format(int(limit)))
+        self.beat_task = loop.create_task(self.beat())
+        if memory:
+            tracemalloc.start(1)
+            self.baseline = tracemalloc.take_snapshot()
+        if cpu == 'cprofile':
+            self.cprofile = cProfile.Profile()
+            self.cprofile.enable()
+        self.thread = threading.Thread(target=self.sample, name='abprofile', daemon=True)
+        self.thread.start()
+        return True
+
+    def stop(self, why=None):
+        """ stop everything, keeping the results for dump """
+        if not self.running:
+            return False
+        self.running = False
+        self.stopped = time.time()
+        if why:
+            self.notes.append(why)
+        self.deadline.cancel()
+        self.beat_task.cancel()
+        self.halt.set()
+        self.thread.join()
+        if self.cprofile:
+            self.cprofile.disable()
+        if tracemalloc.is_tracing():
+            self.final = tracemalloc.take_snapshot()
+            tracemalloc.stop()
+        return True
+
+    async def beat(self):
+        """ mark the event loop as alive for the stall detector """
+        while True:
+            self.heartbeat = time.monotonic()
+            await asyncio.sleep(HEARTBEAT)
+
+    def sample(self):
+        """ body of the sampler thread """
+        last_stall = None
+        while not self.halt.wait(self.interval):
+            t0 = time.perf_counter()
+            frame = sys._current_frames().get(self.main_id)
+            stack = collapse(frame)
+            beat = self.heartbeat
+            lag = time.monotonic() - beat
+            with self.lock:
+                if self.cpu == 'sample':
+                    self.samples[stack] += 1
+                if lag > HEARTBEAT + self.slow:
+                    # roughly how long the loop was stuck in this stack
+                    self.stalls[stack] += self.interval
+                    if beat != last_stall:
+                        self.stall_count += 1
+                        last_stall = beat
+            del frame
+            if tracemalloc.is_tracing() and tracemalloc.get_tracemalloc_memory() > MAX_TRACE_MEMORY:
+                self.final = tracemalloc.take_snapshot()
+                tracemalloc.stop()
+                self.notes.append("memory tracing stopped at its {}MB cap".format(MAX_TRACE_MEMORY >> 20))
+            cost = time.perf_counter() - t0
+            self.sampled_time += cost
+            self.interval = max(SAMPLE_INTERVAL, cost / MAX_OVERHEAD)
+
+    def status(self):
+        """ one line summary """
+        if not self.started:
+            return "Profiler has not been run"
+        end = self.stopped or time.time()
+        text = "Profiler {} ({}s, cpu={}, memory={}, {} loop stalls over {}s".format(
+            'running' if self.running else 'stopped', int(end - self.started), self.cpu,
+            'on' if self.baseline else 'off', self.stall_count, self.slow)
+        text += ", sampler cost {:.2f}s)".format(self.sampled_time)
+        for note in self.notes:
+            text += "\n - " + note
+        return text
+
+    def dump(self, top=25):
+        """ return the results so far as a list of (filename, text) """
+        files = []
+        with self.lock:
+            samples = Counter(self.samples)
+            stalls = Counter(self.stalls)
+
+        if samples:
+            total = sum(samples.values())
+            leaves = Counter()
+            for stack, count in samples.items():
+                leaves[stack.rsplit(';', 1)[-1]] += count
+            text = "{} samples, busiest frames:\n".format(total)
+            for leaf, count in leaves.most_common(top):
+                text += "{:6.2f}% {}\n".format(100.0 * count / total, leaf)
+            text += "\ncollapsed stacks (flamegraph.pl input):\n"
+            for stack, count in samples.most_common():
+                text += "{} {}\n".format(stack, count)
+            files.append(('cpu-samples.txt', text))
+
+        if self.cprofile:
+            out = io.StringIO()
+            if self.running:
+                self.cprofile.disable()
+            stats = pstats.Stats(self.cprofile, stream=out)
+            if self.running:
+                self.cprofile.enable()
+            stats.sort_stats('cumulative').print_stats(top)
+            files.append(('cpu-cprofile.txt', out.getvalue()))
+
+        if self.baseline:
+            snapshot = self.final
+            if snapshot is None and tracemalloc.is_tracing():
+                snapshot = tracemalloc.take_snapshot()
+            if snapshot is not None:
+                ignore = [tracemalloc.Filter(False, tracemalloc.__file__), tracemalloc.Filter(False, __file__)]
+                diff = snapshot.filter_traces(ignore).compare_to(self.baseline.filter_traces(ignore), 'lineno')
+                text = "top {} allocation changes since start:\n".format(top)
+                for stat in diff[:top]:
+                    text += "{}\n".format(stat)
+                files.append(('memory-diff.txt', text))
+
+        if stalls:
+            text = "{} event loop stalls over {}s, stacks seen while stalled:\n".format(self.stall_count, self.slow)
+            for stack, count in stalls.most_common(top):
+                text += "{:6.0f}ms {}\n".format(count * 1000, stack.replace(';', '\n    '))
+            files.append(('slow-callbacks.txt', text))
+        return files
+
+profiler = Profiler()
@@ -0,0 +1,214 @@
+#
+# Fair sharing of the bot between guilds
+#
+import time
+import asyncio
+from collections import deque
+import abconfig
+
+# how many jobs of each class may run at once, when abconfig has no job_quotas
+default_quotas = {'interactive': 8, 'background': 2, 'bulk': 2}
+
+# weight of the newest wait in the average
+EWMA = 0.2
+
+# seconds of run time charged to a job as it starts, until its real run
+# time is known, so that jobs queued together by one guild take turns
+# with the other guilds
+MIN_COST = 0.01
+
+class GuildStats:
+    """ queue depth and wait times for one guild """
+    def __init__(self):
+        self.waiting = dict()
+        self.running = dict()
+        self.jobs = dict()
+        self.avg_wait = dict()
+        self.max_wait = dict()
+
+    def waited(self, jobclass, secs):
+        self.jobs[jobclass] = self.jobs.get(jobclass, 0) + 1
+        if jobclass in self.avg_wait:
+            self.avg_wait[jobclass] += EWMA * (secs - self.avg_wait[jobclass])
+        else:
+            self.avg_wait[jobclass] = secs
+        self.max_wait[jobclass] = max(self.max_wait.get(jobclass, 0), secs)
+
+class Slot:
+    """
+    The right to run one job of a class for a guild, use as
+    'async with scheduler.slot(gid, jobclass) as slot:'
+    """
+    def __init__(self, sched, gid, jobclass):
+        self.sched = sched
+        self.gid = gid
+        self.jobclass = jobclass
+        self.held = False
+        self.began = None
+
+    async def acquire(self, resumed=False):
+        await self.sched.acquire(self.gid, self.jobclass, resumed)
+        self.held = True
+        self.began = time.monotonic()
+
+    def release(self):
+        if self.held:
+            self.held = False
+            self.sched.release(self.gid, self.jobclass, time.monotonic() - self.began)
+
+    async def __aenter__(self):
+        await self.acquire()
+        return self
+
+    async def __aexit__(self, *exc):
+        self.release()
+
+    async def pause(self):
+        """
+        called regularly by long jobs: pay for the time run so far, then
+        give up the slot if a guild that is owed more time is waiting
+        for one, otherwise just let the event loop run
+        """
+        if self.held:
+            now = time.monotonic()
+            self.sched.charge(self.gid, self.jobclass, now - self.began)
+            self.began = now
+            if self.sched.contended(self.gid, self.jobclass):
+                self.release()
+                await self.acquire(resumed=True)
+                return
+        await asyncio.sleep(0)
+
+    async def move(self, jobclass):
+        """ carry on as a different class of job, e.g. a command starting a bulk crawl """
+        self.release()
+        self.jobclass = jobclass
+        await self.acquire()
+
+class Scheduler:
+    """
+    Weighted start time fair queuing between guilds within each class
+    of job, each class having its own concurrency quota so that
+    background and bulk work can never hold up interactive commands.
+    A guild is charged for the time its jobs hold a slot, divided by
+    its weight, and the guild charged least so far goes next.
+    """
+    def __init__(self):
+        self.running = dict()
+        # jobclass -> {gid: deque of futures}
+        self.queues = dict()
+        # (jobclass, gid) -> virtual start time of that guilds next job
+        self.vtime = dict()
+        # jobclass -> virtual time of the last job started
+        self.clock = dict()
+        self.stats = dict()
+
+    def quota(self, jobclass):
+        quotas = getattr(abconfig, 'job_quotas', default_quotas)
+        return quotas.get(jobclass, default_quotas.get(jobclass, 1))
+
+    def weight(self, gid, jobclass):
+        """ a guilds share of a class, from guild_weights in abconfig """
+        weight = getattr(abconfig, 'guild_weights', {}).get(gid, 1)
+        if isinstance(weight, dict):
+            weight = weight.get(jobclass, 1)
+        return weight
+
+    def slot(self, gid, jobclass):
+        return Slot(self, gid, jobclass)
+
+    def guild_stats(self, gid):
+        if gid not in self.stats:
+            self.stats[gid] = GuildStats()
+        return self.stats[gid]
+
+    def waiters(self, jobclass):
+        return sum(len(q) for q in self.queues.get(jobclass, {}).values())
+
+    def tag(self, gid, jobclass):
+        """ virtual time at which a guilds next job would start """
+        return max(self.vtime.get((jobclass, gid), 0), self.clock.get(jobclass, 0))
+
+    def contended(self, gid, jobclass):
+        """ is another guild that has had less than this one waiting for this class of slot """
+        # leaving out the MIN_COST charged as our job started
+        mine = self.vtime.get((jobclass, gid), 0) - MIN_COST / self.weight(gid, jobclass)
+        return any(q and self.tag(g, jobclass) < mine for g, q in self.queues.get(jobclass, {}).items() if g != gid)
+
+    def charge(self, gid, jobclass, ran):
+        """ account for ran seconds of a guilds job holding a slot """
+        key = (jobclass, gid)
+        self.vtime[key] = self.vtime.get(key, 0) + ran / self.weight(gid, jobclass)
+
+    def start(self, gid, jobclass):
+        """ account for a job starting """
+        self.running[jobclass] = self.running.get(jobclass, 0) + 1
+        stats = self.guild_stats(gid)
+        stats.running[jobclass] = stats.running.get(jobclass, 0) + 1
+        key = (jobclass, gid)
+        start = max(self.vtime.get(key, 0), self.clock.get(jobclass, 0))
+        self.clock[jobclass] = start
+        self.vtime[key] = start + MIN_COST / self.weight(gid, jobclass)
+
+    async def acquire(self, gid, jobclass, resumed=False):
+        """ wait for a slot, resumed is a job carrying on after a pause rather than a new one """
+        stats = self.guild_stats(gid)
+        began = time.monotonic()
+        if self.running.get(jobclass, 0) < self.quota(jobclass) and not self.waiters(jobclass):
+            self.start(gid, jobclass)
+        else:
+            fut = asyncio.get_running_loop().create_future()
+            self.queues.setdefault(jobclass, dict()).setdefault(gid, deque()).append(fut)
+            stats.waiting[jobclass] = stats.waiting.get(jobclass, 0) + 1
+            try:
+                await fut
+            except asyncio.CancelledError:
+                if fut.done() and not fut.cancelled():
+                    # granted just as we were cancelled, hand it on
+                    self.release(gid, jobclass)
+                else:
+                    queue = self.queues.get(jobclass, {}).get(gid)
+                    if queue and fut in queue:
+                        queue.remove(fut)
+                raise
+            finally:
+                stats.waiting[jobclass] -= 1
+        if not resumed:
+            stats.waited(jobclass, time.monotonic() - began)
+
+    def release(self, gid, jobclass, ran=0):
+        """ a job gave up its slot after holding it for ran seconds more """
+        self.running[jobclass] -= 1
+        # settle up the MIN_COST charged as it started
+        self.charge(gid, jobclass, ran - MIN_COST)
+        stats = self.guild_stats(gid)
+        stats.running[jobclass] -= 1
+        self.dispatch(jobclass)
+
+    def dispatch(self, jobclass):
+        """ start waiting jobs, the guild with the lowest virtual time first """
+        queues = self.queues.get(jobclass, {})
+        while self.running.get(jobclass, 0) < self.quota(jobclass):
+            ready = [gid for gid, q in queues.items() if q]
+            if not ready:
+                break
+            gid = min(ready, key=lambda g: self.tag(g, jobclass))
+            fut = queues[gid].popleft()
+            if not queues[gid]:
+                del queues[gid]
+            if fut.cancelled():
+                continue
+            self.start(gid, jobclass)
+            fut.set_result(None)
+
+    def report(self, gid):
+        """ lines describing one guilds queues """
+        stats = self.guild_stats(gid)
+        lines = []
+        for jobclass in sorted(set(default_quotas) | set(stats.jobs)):
+            lines.append("{}: weight {}, {} running, {} queued, {} jobs, wait avg {:.3f}s max {:.3f}s".format(
+                jobclass, self.weight(gid, jobclass), stats.running.get(jobclass, 0), stats.waiting.get(jobclass, 0),
+                stats.jobs.get(jobclass, 0), stats.avg_wait.get(jobclass, 0), stats.max_wait.get(jobclass, 0)))
+        return lines
+
+scheduler = Scheduler()
@@ -0,0 +1,70 @@
+#
+# Warm restart snapshot of the ALiceBot in memory state
+#
+import os
+import mmap
+import struct
+import pickle
+import zlib
+
+MAGIC = b'ABSNAP'
+# bump whenever the layout of the saved state changes
+VERSION = 1
+
+# magic, version, crc32 of the payload
+HEADER = struct.Struct('<6sHI')
+
+def generation(path):
+    """ identify the current contents of a storage file """
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return (st.st_mtime_ns, st.st_size)
+
+def save(path, state):
+    """ write the state out atomically """
+    payload = pickle.dumps(state, protocol=pickle.HIGHEST_PROTOCOL)
+    tmp = path + '.tmp'
+    with open(tmp, 'wb') as f:
+        f.write(HEADER.pack(MAGIC, VERSION, zlib.crc32(payload)))
+        f.write(payload)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+def load(path):
+    """
+    Read a snapshot and remove it so that it is only ever used once.
+    Returns None when there is none, or it is damaged or from another version.
+    """
+    try:
+        f = open(path, 'rb')
+    except OSError:
+        return None
+    with f:
+        try:
+            mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            # empty file
+            mm = None
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+    if mm is None:
+        return None
+
+    with mm:
+        if len(mm) < HEADER.size:
+            return None
+        (magic, version, crc) = HEADER.unpack_from(mm)
+        if magic != MAGIC or version != VERSION:
+            return None
+        payload = mm[HEADER.size:]
+    if zlib.crc32(payload) != crc:
+        return None
+    try:
+        return pickle.loads(payload)
+    except Exception:
+        return None
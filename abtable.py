@@ -0,0 +1,67 @@
+#
+# Streaming CSV/JSON reading and writing for bulk import and export
+#
+import io
+import csv
+import json
+
+formats = ('csv', 'json')
+
+# what reading a damaged file can raise
+errors = (ValueError, csv.Error)
+
+def file_format(filename):
+    """ work out the format from a filename, or None """
+    ext = filename.rsplit('.', 1)[-1].lower()
+    if ext in formats:
+        return ext
+    return None
+
+def read_rows(fp, fmt, columns):
+    """
+    Yield (line, row) for each row of a binary file, where row is a
+    dict of the named columns, None for a column the row does not have
+    at all.  CSV is read a line at a time and may have a header row;
+    JSON is either a list of objects or, for two columns, an object
+    mapping the first column to the second, and is parsed in one go.
+    """
+    text = io.TextIOWrapper(fp, encoding='utf-8-sig', newline='')
+    if fmt == 'csv':
+        reader = csv.reader(text)
+        for row in reader:
+            if not row or not any(row):
+                continue
+            if reader.line_num == 1 and [c.strip().lower() for c in row] == list(columns[:len(row)]):
+                continue
+            row = row + [None] * (len(columns) - len(row))
+            yield (reader.line_num, dict(zip(columns, row)))
+    else:
+        data = json.load(text)
+        if isinstance(data, dict) and len(columns) == 2:
+            data = [{columns[0]: k, columns[1]: v} for k, v in data.items()]
+        if not isinstance(data, list):
+            raise ValueError("expected a list of objects")
+        for num, item in enumerate(data, 1):
+            if not isinstance(item, dict):
+                raise ValueError("entry %d is not an object" % num)
+            yield (num, {c: None if c not in item else '' if item[c] is None else str(item[c]) for c in columns})
+
+def write_rows(fp, fmt, columns, rows):
+    """
+    Write rows (tuples in column order) to a binary file one at a time
+    """
+    text = io.TextIOWrapper(fp, encoding='utf-8', newline='', write_through=True)
+    if fmt == 'csv':
+        writer = csv.writer(text)
+        writer.writerow(columns)
+        for row in rows:
+            writer.writerow(row)
+    else:
+        sep = '[\n'
+        for row in rows:
+            text.write(sep + json.dumps(dict(zip(columns, row))))
+            sep = ',\n'
+        if sep == '[\n':
+            text.write('[')
+        text.write('\n]\n')
+    text.detach()
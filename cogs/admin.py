@@ -0,0 +1,345 @@
+#
+# Server administration commands
+#
+import io
+import os
+import time
+from datetime import datetime
+import discord
+from discord.ext import commands
+import ablog
+from abprofile import profiler
+import abscheduler
+from abcore import known_config, logfile, log, isfloat, parse_interval, parse_when
+from abcore import perm_check, find_config, config_get, config_set
+from abcore import db_path, archive_get, archive_idle
+
+class Admin(commands.Cog):
+    """ .config .access .logs .archive .profile and .scheduler """
+    def __init__(self, bot):
+        self.bot = bot
+
+    @commands.command()
+    async def config(self, ctx, *args):
+        '''
+        Configuration commands
+        '''
+        if not perm_check(ctx, 0):
+            return
+
+        gid = ctx.guild.id
+        if not args or args[0] == 'list':
+            text = "AliceBot config values :-\n"
+            for key in known_config:
+                text = text + "* " + key[0] + " = "
+                val = config_get(ctx.guild, 'config', key[0], type=key[1])
+                if not val:
+                    text = text + "_Not set_\n"
+                elif key[1] == 'role':
+                        text += "'@{}' [{}]\n".format(val.name,val.id)
+                elif key[1] == 'channel':
+                        text += "'#{}' [{}]\n".format(val.name,val.id)
+                else:
+                    text = text + "'" + str(val) + "'\n"
+        elif args[0] == "help":
+            text = "config set {key} {value}\nconfig get {key}\nconfig unset {key}\n"
+        elif args[0] == 'get':
+            if not args[1]:
+                text = 'Usage: config get {value}'
+            else:
+                key = find_config(args[1])
+                if not key:
+                    text = "Unknown config value '"+args[1]+"'"
+                else:
+                    val = config_get(ctx.guild, 'config', key[0], type=key[1])
+                    if not val:
+                        text = "No config set for '"+key[0]+"'"
+                    elif key[1] == 'role':
+                        text = "Config {} = @{} [{}]".format(key[0],val.name,val.id)
+                    elif key[1] == 'channel':
+                        text = "Config {} = #{} [{}]".format(key[0],val.name,val.id)
+                    else:
+                        text = "Config {} = {}".format(key[0],val)
+        elif args[0] == 'set':
+            if not args[1] or not args[2]:
+                text = "Usage: config set key value"
+            elif not find_config(args[1]):
+                text = "Unknown config setting %s" % (args[1])
+            else:
+                key = find_config(args[1])
+                value = args[2]
+                if key[1] == 'role':
+                    if ctx.message.role_mentions:
+                        role = ctx.message.role_mentions[0]
+                    else:
+                        role = ctx.guild.get_role(int(value))
+                    if not role:
+                        text = "Could not find a role matching %s" % (value)
+                    else:
+                        config_set(ctx.guild, 'config', key[0], role.id)
+                        text = "Set config %s = %d (%s)" % (key[0], role.id, role.name)
+                elif key[1] == 'channel':
+                    if ctx.message.channel_mentions:
+                        channel = ctx.message.channel_mentions[0]
+                    else:
+                        channel = ctx.guild.get_channel(int(value))
+                    if not channel:
+                        text = "Could not find channel matching %s" % (value)
+                    else:
+                        config_set(ctx.guild, 'config', key[0], channel.id)
+                        text = "Set config %s = %d (%s)" % (key[0], channel.id, channel.name)
+
+                else:
+                    config_set(ctx.guild, 'config', key[0], value)
+                    text = "Set config %s = %s" % (key[0], value)
+                log(ctx.guild, ctx.channel, "User {}[{}] just set config {}={}".format(ctx.author.display_name, ctx.author.id, key[0], value))
+        elif args[0] == 'unset':
+            if not args[1]:
+                text = 'Usage: config unset {key}'
+            else:
+                key = find_config(args[1])
+                if not key:
+                    text = "Unknown config value '"+args[1]+"'"
+                else:
+                    val = config_set(ctx.guild, 'config', key[0], None)
+                    text = "Removed config value for '"+key[0]+"'"
+        else:
+            text = "Unrecognised operation " + args[0]
+        await ctx.send(text)
+
+    @commands.command()
+    async def access(self, ctx, *args):
+        '''
+        Access control to commands
+        '''
+        if not perm_check(ctx, 0):
+            return
+
+        if not args or args[0] == 'list':
+            text = "Usage: access list                  - list all commands\n"
+            text += "       access set {command} {role}  - restrict usage of command\n"
+            text += "       access unset {command}       - remove restriction\n"
+            text += "Command access permissions :-\n"
+            for cmd in self.bot.commands:
+                text = text + " * {} - ".format(cmd.name)
+                val = config_get(ctx.guild, 'access', cmd.name)
+                if cmd.name in ('config','access'):
+                    text = text + 'Admin only (not configurable)'
+                elif not val:
+                    text = text + 'No restriction'
+                else:
+                    role = ctx.guild.get_role(val)
+                    if not role:
+                        text = text + "Role {} not found!".format(val)
+                    else:
+                        text = text + "@{} [{}]".format(role.name, role.id)
+                text = text + "\n"
+        elif args[0] == 'set':
+            if not args[1] or not args[2]:
+                text = "Usage: .access set {command} {role}"
+            else:
+                cmd = None
+                role = None
+                for c in self.bot.commands:
+                    if c.name == args[1]:
+                        cmd = c
+
+                if ctx.message.role_mentions:
+                    role = ctx.message.role_mentions[0]
+                else:
+                    role = ctx.guild.get_role(int(args[2]))
+
+                if not cmd:
+                    text = "Could not find command '{}'".format(args[1])
+                if not role:
+                    text = "Please mention a role"
+                else:
+                    config_set(ctx.guild, 'access', cmd.name, role.id)
+                    text = "Restricting {} command to @{} [id:{}]".format(cmd.name, role.name, role.id)
+                    log(ctx.guild, ctx.channel, "User {}[{}] restricted {} to {}[{}]".format(ctx.author.display_name, ctx.author.id, cmd.name, role.name, role.id))
+        elif args[0] == 'unset':
+            cmd = None
+            for c in self.bot.commands:
+                if c.name == args[1]:
+                    cmd = c
+            if not cmd:
+                text = "Could not find command '{}'".format(args[1])
+            else:
+                config_set(ctx.guild, "access", cmd.name, None)
+                text = "Removing restriction on command {}".format(cmd.name)
+                log(ctx.guild, ctx.channel, "User {}[{}] unrestricted {}".format(ctx.author.display_name, ctx.author.id, cmd.name))
+        else:
+            text = "Unrecognised operation " + args[0]
+
+        await ctx.send(text)
+
+    @commands.command()
+    async def logs(self, ctx, *args):
+        '''
+        Search the bot logfile
+        '''
+        if not perm_check(ctx, 0):
+            return
+
+        if args and args[0] == 'help':
+            text = "Usage: logs [since={when}] [until={when}] [channel={#channel}] [text...]\n"
+            text += "       {when} is an interval ago such as 2d12h, or a date YYYY-MM-DD[THH:MM]\n"
+            text += "e.g.   logs since=7d config\n"
+            await ctx.send(text)
+            return
+
+        since = time.time() - 86400
+        until = None
+        guild = ctx.guild.id
+        channel = None
+        words = []
+        for arg in args:
+            (name, sep, value) = arg.partition('=')
+            if sep and name in ('since', 'until'):
+                when = parse_when(value)
+                if when is None:
+                    await ctx.send("Could not understand the time '{}'".format(value))
+                    return
+                if name == 'since':
+                    since = when
+                else:
+                    until = when
+            elif sep and name == 'channel':
+                if ctx.message.channel_mentions:
+                    channel = ctx.message.channel_mentions[0].name
+                else:
+                    channel = value.lstrip('#')
+            elif sep and name == 'guild':
+                # other servers logs are only for the bot owner
+                if not await self.bot.is_owner(ctx.author):
+                    await ctx.send("Only the bot owner can search other servers logs")
+                    return
+                guild = None if value == 'all' else value
+            else:
+                words.append(arg)
+
+        text = " ".join(words) or None
+        found, truncated = await self.bot.loop.run_in_executor(None,
+                lambda: ablog.search(logfile, since, until, guild, channel, text))
+        log(ctx.guild, ctx.channel, "User {}[{}] searched logs for '{}' ({} found)".format(ctx.author.display_name, ctx.author.id, text, len(found)))
+
+        if not found:
+            await ctx.send("No matching log entries")
+            return
+        body = "\n".join(found)
+        summary = "{} matching log entries".format(len(found))
+        if truncated:
+            summary += " (stopped at the first {}, narrow the search to see more)".format(len(found))
+        if len(body) + len(summary) < 1900:
+            await ctx.send("{}\n```\n{}\n```".format(summary, body))
+        else:
+            await ctx.send(summary, file=discord.File(io.BytesIO(body.encode()), filename='alicebot-logs.txt'))
+
+    @commands.command()
+    async def archive(self, ctx, *args):
+        '''
+        Cold storage for departed and idle members
+        '''
+        if not perm_check(ctx, 0):
+            return
+
+        archive = archive_get(ctx.guild)
+        dbfile = db_path(ctx.guild.id)
+        if not args:
+            text = "{} members archived, archive {} bytes ({} reclaimable), db {} bytes".format(
+                len(archive), archive.size(), archive.dead, os.path.getsize(dbfile))
+        elif args[0] == 'compact':
+            before = os.path.getsize(dbfile) + archive.size()
+            count = 0
+            idle = config_get(ctx.guild, 'config', 'archive_idle', type='interval')
+            if idle:
+                count = archive_idle(ctx.guild, datetime.utcnow() - idle)
+            archive.compact()
+            after = os.path.getsize(dbfile) + archive.size()
+            text = "Archived {} idle members and compacted, reclaimed {} bytes ({} now)".format(count, before - after, after)
+            log(ctx.guild, ctx.channel, "User {}[{}] compacted the archive: {}".format(ctx.author.display_name, ctx.author.id, text))
+        else:
+            text = "Usage: archive          - show the archive size\n"
+            text += "       archive compact  - archive idle members now and reclaim space\n"
+        await ctx.send(text)
+
+    @commands.command()
+    async def scheduler(self, ctx, *args):
+        '''
+        Job queue depth and wait times
+        '''
+        if not perm_check(ctx, 0):
+            return
+
+        if args and args[0] == 'all':
+            if not await self.bot.is_owner(ctx.author):
+                await ctx.send("Only the bot owner can see other servers queues")
+                return
+            gids = sorted(abscheduler.scheduler.stats)
+        else:
+            gids = [ctx.guild.id]
+        text = "Running: " + ", ".join("{} {}/{}".format(jobclass, abscheduler.scheduler.running.get(jobclass, 0), abscheduler.scheduler.quota(jobclass))
+                                       for jobclass in sorted(abscheduler.scheduler.running)) + "\n"
+        for gid in gids:
+            guild = self.bot.get_guild(gid)
+            text += "{} [{}]\n".format(guild.name if guild else '-', gid)
+            for line in abscheduler.scheduler.report(gid):
+                text += " * " + line + "\n"
+        if len(text) < 1900:
+            await ctx.send(text)
+        else:
+            await ctx.send(file=discord.File(io.BytesIO(text.encode()), filename='scheduler.txt'))
+
+    @commands.command()
+    async def profile(self, ctx, *args):
+        '''
+        Profile the running bot
+        '''
+        # it sees every guild, so it is only for the bot owner
+        if not await self.bot.is_owner(ctx.author):
+            await ctx.send("Only the bot owner can profile the bot")
+            return
+
+        if not args:
+            await ctx.send(profiler.status())
+        elif args[0] == 'start':
+            cpu = 'sample'
+            memory = False
+            slow = 0.1
+            limit = 300
+            for arg in args[1:]:
+                (name, sep, value) = arg.partition('=')
+                if name == 'cpu' and value in ('sample', 'cprofile', 'off'):
+                    cpu = value
+                elif name == 'memory' and value in ('on', 'off'):
+                    memory = value == 'on'
+                elif name == 'slow' and isfloat(value):
+                    slow = float(value)
+                elif name == 'limit' and parse_interval(value):
+                    limit = parse_interval(value).total_seconds()
+                else:
+                    await ctx.send("Unrecognised profile option '{}'".format(arg))
+                    return
+            if not profiler.start(cpu=cpu, memory=memory, slow=slow, limit=limit):
+                await ctx.send("The profiler is already running")
+                return
+            log(ctx.guild, ctx.channel, "User {}[{}] started profiling".format(ctx.author.display_name, ctx.author.id))
+            await ctx.send(profiler.status())
+        elif args[0] == 'stop':
+            profiler.stop("stopped by " + ctx.author.display_name)
+            await ctx.send(profiler.status())
+        elif args[0] == 'dump':
+            top = 25
+            if len(args) > 1 and args[1].isdigit():
+                top = int(args[1])
+            files = [discord.File(io.BytesIO(text.encode()), filename=name) for name, text in profiler.dump(top)]
+            await ctx.send(profiler.status(), files=files)
+        else:
+            text = "Usage: profile                  - show the profiler status\n"
+            text += "       profile start [cpu=sample|cprofile|off] [memory=on|off] [slow={secs}] [limit={interval}]\n"
+            text += "       profile stop\n"
+            text += "       profile dump [{top}]     - attach the results so far\n"
+            await ctx.send(text)
+
+async def setup(bot):
+    await bot.add_cog(Admin(bot))
@@ -0,0 +1,390 @@
+#
+# Member commands, invites and the periodic member jobs
+#
+import time
+import asyncio
+import discord
+from discord.ext import tasks, commands
+from datetime import datetime
+import abconfig
+import abmembers
+import abinvites
+from abscheduler import scheduler
+from abcore import botconfig, log, timestr, timesince, perm_check, config_get
+from abcore import db_get, db_set, guild_members, members_refresh, members_with_role
+from abcore import archive_members, archive_restore, archive_idle, next_runs
+
+INTROS_CHANNEL_ID = 1228760060277166241
+
+def invite_timespan(guild):
+    """ how long invites last in seconds """
+    timespan = config_get(guild, 'config',  'invite_timespan', 'interval')
+    if not timespan:
+        return 3600
+    return timespan.total_seconds()
+
+async def invite_refill(channel, timespan):
+    """
+    Retire stale invites in a channels pool and top it up to match
+    demand, as a background job of the channels guild
+    """
+    pool = abinvites.get_pool(channel.guild.id, channel.id, timespan)
+    if pool.lock.locked():
+        return
+    async with pool.lock, scheduler.slot(channel.guild.id, 'background'):
+        for stale in pool.retire(time.time(), timespan):
+            try:
+                await stale.delete(reason="Unused pooled invite expired")
+            except discord.HTTPException:
+                pass
+        while len(pool) < pool.target(time.time()):
+            try:
+                link = await channel.create_invite(max_age=timespan, max_uses=1, unique=True, reason="Pooled for .invite")
+            except discord.HTTPException as err:
+                log(channel.guild, channel, "Could not refill invite pool: {}".format(err))
+                break
+            pool.add(link, time.time())
+
+class Members(commands.Cog):
+    """ member commands, autokick and the other periodic jobs """
+    def __init__(self, bot):
+        self.bot = bot
+
+    async def cog_load(self):
+        # on a .reload the bot is already up and running
+        if self.bot.is_ready():
+            self.start_loops()
+
+    async def cog_unload(self):
+        # let a sweep in progress finish, and remember when each job is
+        # next due so the reloaded cog does not run them all straight away
+        for loop in self.loops():
+            if loop.next_iteration:
+                next_runs[loop.coro.__name__] = loop.next_iteration
+            loop.stop()
+
+    def loops(self):
+        return (self.periodic_autokick, self.periodic_flush, self.periodic_invites, self.periodic_archive)
+
+    def start_loops(self):
+        """ start any periodic job that is not already running """
+        for loop in self.loops():
+            if not loop.is_running():
+                loop.start()
+
+    def replaced(self):
+        """ has a .reload swapped in a new copy of this cog """
+        return self.bot.get_cog(self.qualified_name) is not self
+
+    async def resume(self, name):
+        """ before a periodic job first runs, wait until it was due before a .reload """
+        when = next_runs.pop(name, None)
+        if when:
+            await discord.utils.sleep_until(when)
+
+    @commands.Cog.listener()
+    async def on_config_loaded(self):
+        """ every guild has its db and config, see on_ready """
+        self.start_loops()
+
+    @commands.command()
+    async def ping(self, ctx):
+        '''
+        Simple command to respond
+        '''
+        if not perm_check(ctx, None):
+            return
+
+        u = ctx.author
+        c = db_get(ctx.guild, u, 'PingCount', 'count')
+        if not c:
+            c = 1
+        else:
+            c = c + 1
+        db_set(ctx.guild, u, 'PingCount', 'count', c)
+
+        await ctx.send(u.display_name + ' you have said ping ' + str(c) + ' times')
+
+    @commands.command()
+    async def invite(self, ctx):
+        '''
+        create a 24hour invite
+        '''
+        if not perm_check(ctx, 676891619773120589):
+            return
+        u = ctx.author
+        mintime = config_get(ctx.guild, 'config', 'invite_cooldown', 'interval')
+        if not mintime:
+            mintime = 3600
+        else:
+            mintime = mintime.total_seconds()
+
+        timespan = invite_timespan(ctx.guild)
+
+        last = db_get(ctx.guild, u, "invite", "last")
+        now = int(time.time())
+        if not last or last == 0 or (now - last) > mintime:
+            pool = abinvites.get_pool(ctx.guild.id, ctx.channel.id, timespan)
+            taken = pool.take(time.time(), timespan)
+            if taken:
+                (link, remain) = taken
+            else:
+                link = await discord.TextChannel.create_invite(ctx.message.channel, max_age=timespan, max_uses=1, unique=True)
+                remain = timespan
+            dur = timestr(int(remain))
+            try:
+                await u.send('Here is an invite valid for {} {}'.format(dur, link.url))
+            except discord.HTTPException:
+                pool.put_back(link, time.time() - (timespan - remain))
+                await ctx.send('Sorry '+u.display_name+', I could not send you a direct message')
+                return
+            await ctx.send('Invite sent to '+u.display_name)
+            pool.record(link, u.id, time.time())
+            task = asyncio.create_task(invite_refill(ctx.channel, timespan))
+            abinvites.refills.add(task)
+            task.add_done_callback(abinvites.refills.discard)
+            db_set(ctx.guild, u, "invite", "last", now)
+            log(ctx.guild, ctx.channel, "{}[{}] created an {} invite".format(ctx.author.display_name, ctx.author.id, dur))
+        else:
+            delta = now - last
+            remain = int(mintime - delta)
+            await ctx.send('Sorry '+u.display_name+', you have issued an invite too recently, please wait another '+timestr(remain))
+
+    @commands.command()
+    @commands.has_any_role('Greeters', 'Moderators', 'Admins')
+    async def member(self, ctx, member: discord.Member):
+        await self.membersilent(ctx, member)
+
+        #Also send a message to #introductions informing the community of this new user.
+        intros_channel = ctx.guild.get_channel(INTROS_CHANNEL_ID) or await ctx.guild.fetch_channel(INTROS_CHANNEL_ID)
+        await intros_channel.send(f"Welcome, {member.mention}! Please introduce yourself! What's your favorite food? What movies or shows have you enjoyed recently? Is pineapple a pizza topping? Is a hot dog a sandwich? And other questions in the pins for this channel if you need some inspiration.")
+
+    @commands.command()
+    @commands.has_any_role('Greeters', 'Moderators', 'Admins')
+    async def membersilent(self, ctx, member: discord.Member):
+        # Get the role object for the "member" role
+        role = discord.utils.get(ctx.guild.roles, name="member")
+
+        # Add the "member" role to the member object
+        await member.add_roles(role)
+
+        # Send a message confirming that the member has been granted the "member" role
+        await ctx.send(f"{member.mention} has been granted the 'member' role! Please use <#630312311789191188> to complete your profile (note: your pronoun selection will open gendered chat spaces)")
+        await ctx.send(f"Welcome {member.mention}, you are now a member of TransLater! You may now click the reactions in <#630312311789191188> and <#1227053053471887371> to assign roles to yourself. They are organized in categories explaining what they are for; selecting one or more gender identity roles will unlock gender-specific channels.")
+        await ctx.send(f"Welcome {member.mention}, you are now a member of TransLater! We look forward to getting to know you!\n\nYou may now click the reactions in <#1227053053471887371> to open access to different channels or receive alerts for different community activities. For example, selecting one or more gender identity roles will unlock gender-specific channels.\n\nIf you haven't already, please review our <#628881740194250774>, and you can select vanity roles in <#630312311789191188> for your community profile. You can also add your pronouns to your Discord profile, either for Discord as a whole or just for TransLater. Find out more here: https://discord.com/channels/481113082005946368/1227159893577043990")
+
+    @member.error
+    async def member_error(self, ctx, error):
+        if isinstance(error, commands.BadArgument):
+            try:
+                member = await commands.MemberConverter().convert(ctx, ctx.message.content.split()[1])
+            except commands.errors.MemberNotFound:
+                await ctx.send("Invalid member provided. Please specify a valid user ID or username (with or without discriminator).")
+                return
+            await member.add_roles(discord.utils.get(ctx.guild.roles, name="member"))
+            await ctx.send(f"{member.mention} has been granted the 'member' role!")
+        elif isinstance(error, commands.MissingAnyRole):
+            await ctx.send("You do not have permission to use this command.")
+
+    @commands.command()
+    async def userinfo(self, ctx, *args):
+        '''
+        Forced Update of the user info db
+        '''
+        if not perm_check(ctx, 0):
+            return
+
+        if args and args[0] == 'update':
+            # a long crawl, queue it with the other bulk jobs
+            await ctx.slot.move('bulk')
+            count = 0
+            async for mem in guild_members(ctx.guild):
+                db_set(ctx.guild, mem, "info", "joined", str(mem.joined_at))
+                db_set(ctx.guild, mem, "info", "nick", mem.nick)
+                count += 1
+                if count % 100 == 0:
+                    await ctx.slot.pause()
+            text = "Updated %d members." % count
+            lastmsg = {}
+            seen = 0
+            for chan in ctx.guild.channels:
+                if chan.type != discord.ChannelType.text:
+                    continue
+                hist = chan.history(limit=None)
+                async for msg in hist:
+                    seen += 1
+                    if seen % 100 == 0:
+                        await ctx.slot.pause()
+                    if msg.author.id in lastmsg:
+                        if msg.created_at > lastmsg[msg.author.id]:
+                            lastmsg[msg.author.id] = msg.created_at
+                    else:
+                        lastmsg[msg.author.id] = msg.created_at
+            for uid in lastmsg:
+                mem = self.bot.get_user(uid) or discord.Object(id=uid)
+                db_set(ctx.guild, mem, "info", "lastmsg", str(lastmsg[uid]))
+            text += "\nUpdated %d users last message time." % len(lastmsg)
+        elif args[0]:
+            uid = int(args[0])
+            mem = self.bot.get_user(uid) or await self.bot.fetch_user(uid)
+            joined = db_get(ctx.guild, mem, "info", "joined")
+            if not joined and ctx.guild.id in abmembers.tables:
+                when = abmembers.tables[ctx.guild.id].get_joined(uid)
+                if when:
+                    joined = datetime.utcfromtimestamp(when).strftime('%Y-%m-%d %H:%M:%S.%f')
+            nick = db_get(ctx.guild, mem, "info", "nick")
+            lastmsg = db_get(ctx.guild, mem, "info", "lastmsg")
+            text = ">>> User: %s#%s (ID: %d)" % (mem.name, mem.discriminator, uid)
+            if joined:
+                text += "\nJoined: %s ago." % timesince(joined)
+            if nick:
+                text += "\nLast Nickname: %s" % nick
+            if lastmsg:
+                text += "\nLast message: %s ago." % timesince(lastmsg)
+            if botconfig[ctx.guild.id]['mee6']:
+                try:
+                    mee6API = botconfig[ctx.guild.id]['mee6']
+                    level = await mee6API.levels.get_user_level(mem.id)
+                    text += "\nMEE6 Level: %s" % level
+                except Exception:
+                    pass
+        await ctx.send(text)
+
+    @tasks.loop(minutes=60)
+    async def periodic_autokick(self):
+        """ check for users that should be kicked """
+        if self.replaced():
+            return
+        log(None, None, "AutoKick Timed loop")
+        today = discord.utils.utcnow()
+        # each guild is its own bulk job, so a huge guild cannot hold up the rest
+        guilds = list(self.bot.guilds)
+        results = await asyncio.gather(*[self.autokick_guild(guild, today) for guild in guilds], return_exceptions=True)
+        for guild, result in zip(guilds, results):
+            if isinstance(result, Exception):
+                log(guild, None, "AutoKick failed: {}".format(result))
+
+    async def autokick_guild(self, guild, today):
+        """ kick the users of one guild that have had autokick_hasrole for too long """
+        async with scheduler.slot(guild.id, 'bulk') as slot:
+            log(guild, None, 'Guild '+guild.name+' has '+str(guild.member_count)+' members.')
+            wantrole = config_get(guild, 'config', 'autokick_hasrole' )
+            timeout = config_get(guild, 'config', 'autokick_timelimit', type='interval')
+            reason = config_get(guild, 'config', 'autokick_reason')
+            channel = config_get(guild, 'config', 'log_channel', type='channel')
+            logtext = str()
+            if wantrole and timeout:
+                if abconfig.low_memory:
+                    await members_refresh(guild, slot)
+                for (member, name, joined) in list(members_with_role(guild, wantrole)):
+                    onfor = today - joined
+                    if onfor > timeout:
+                        logtext += " - %s expired by %s\n" % ( name, str(onfor - timeout))
+                        if reason:
+                            db_set(guild, member, "info", "kicked", reason)
+                            await guild.kick(member, reason=reason)
+                            await slot.pause()
+                        else:
+                            #await guild.kick(member)
+                            pass
+            if logtext and channel:
+                if reason:
+                    info = "The following users have been autokicked :-\n"
+                else:
+                    info = "The following users will be kicked if you set autokick_reason:\n"
+                await channel.send(info + logtext)
+
+    @tasks.loop(minutes=2)
+    async def periodic_flush(self):
+        """ Write out the last message log"""
+        if self.replaced():
+            return
+        today = datetime.utcnow()
+        for guild in self.bot.guilds:
+            userlist = botconfig[guild.id]['last_msg']
+            botconfig[guild.id]['last_msg'] = dict()
+            for uid, when in userlist.items():
+                mem = self.bot.get_user(uid) or discord.Object(id=uid)
+                # they are active again, so out of the archive
+                archive_restore(guild, uid)
+                db_set(guild, mem, "info", "lastmsg", str(when))
+
+    @tasks.loop(minutes=1)
+    async def periodic_invites(self):
+        """ keep the invite pools fresh and sized to demand """
+        if self.replaced():
+            return
+        for (gid, cid) in list(abinvites.pools):
+            channel = self.bot.get_channel(cid)
+            if not channel:
+                del abinvites.pools[(gid, cid)]
+                continue
+            await invite_refill(channel, invite_timespan(channel.guild))
+
+    @tasks.loop(hours=6)
+    async def periodic_archive(self):
+        """ move members idle for longer than archive_idle to the archive """
+        if self.replaced():
+            return
+        today = datetime.utcnow()
+        for guild in self.bot.guilds:
+            idle = config_get(guild, 'config', 'archive_idle', type='interval')
+            if not idle:
+                continue
+            async with scheduler.slot(guild.id, 'background'):
+                count = archive_idle(guild, today - idle)
+            if count:
+                log(guild, None, "Archived {} members idle for over {}".format(count, idle))
+
+    @periodic_autokick.before_loop
+    async def autokick_resume(self):
+        await self.resume('periodic_autokick')
+
+    @periodic_flush.before_loop
+    async def flush_resume(self):
+        await self.resume('periodic_flush')
+
+    @periodic_invites.before_loop
+    async def invites_resume(self):
+        await self.resume('periodic_invites')
+
+    @periodic_archive.before_loop
+    async def archive_resume(self):
+        await self.resume('periodic_archive')
+
+    @commands.Cog.listener()
+    async def on_member_join(self, member):
+        """
+        bring back anything archived when they left, and
+        keep the low memory member table up to date
+        """
+        archive_restore(member.guild, member.id)
+        table = abmembers.tables.get(member.guild.id)
+        if table is not None:
+            joined = member.joined_at.timestamp() if member.joined_at else time.time()
+            table.add(member.id, joined, [r.id for r in member.roles])
+
+    @commands.Cog.listener()
+    async def on_raw_member_remove(self, payload):
+        """
+        someone left, was kicked or banned, cached or not
+        """
+        guild = self.bot.get_guild(payload.guild_id)
+        if guild and guild.id in botconfig:
+            archive_members(guild, [payload.user.id])
+        table = abmembers.tables.get(payload.guild_id)
+        if table is not None:
+            table.remove(payload.user.id)
+
+    @commands.Cog.listener()
+    async def on_invite_delete(self, invite):
+        """
+        an invite was used up, expired or deleted, never hand it out
+        """
+        if invite.guild and invite.channel:
+            pool = abinvites.pools.get((invite.guild.id, invite.channel.id))
+            if pool:
+                pool.discard(invite.code)
+
+async def setup(bot):
+    await bot.add_cog(Members(bot))
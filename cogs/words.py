@@ -0,0 +1,326 @@
+#
+# Dictionary and unit conversion commands
+#
+import io
+import tempfile
+import discord
+from discord.ext import commands
+import abconfig
+import abtable
+from abcore import botconfig, log, isfloat, isexpression, perm_check
+from abcore import config_read, config_set, config_set_many, config_get
+from abcore import convert_makekey, convert_splitkey
+
+async def bulk_import(ctx, section, columns, parse_row):
+    """
+    Validate every row of an attached csv/json file then apply them
+    all at once, returns the text of the response
+    """
+    if not ctx.message.attachments:
+        return "Please attach a .csv or .json file to import"
+    attachment = ctx.message.attachments[0]
+    fmt = abtable.file_format(attachment.filename)
+    if not fmt:
+        return "Sorry I can only import .csv or .json files"
+
+    entries = dict()
+    errors = []
+    try:
+        data = io.BytesIO(await attachment.read())
+        for (num, row) in abtable.read_rows(data, fmt, columns):
+            (key, value, err) = parse_row(row)
+            if err:
+                errors.append("{} {}: {}".format('line' if fmt == 'csv' else 'entry', num, err))
+            else:
+                entries[key] = value
+    except abtable.errors as err:
+        errors.append("Could not read {}: {}".format(attachment.filename, err))
+
+    if errors:
+        text = "Import failed, nothing was changed:\n" + "\n".join(errors[:10])
+        if len(errors) > 10:
+            text += "\n... and {} more".format(len(errors) - 10)
+        return text
+    if not entries:
+        return "Nothing to import in {}".format(attachment.filename)
+
+    config_set_many(ctx.guild, section, entries)
+    removed = sum(1 for value in entries.values() if not value)
+    log(ctx.guild, ctx.channel, "User {}[{}] imported {} {} entries from {}".format(ctx.author.display_name, ctx.author.id, len(entries), section, attachment.filename))
+    return "Imported {} entries ({} removed) from {}".format(len(entries), removed, attachment.filename)
+
+async def bulk_export(ctx, section, columns, args, rows):
+    """
+    Write the rows out to a temporary file and attach it
+    """
+    fmt = 'csv'
+    if len(args) > 1:
+        fmt = args[1].lower()
+    if fmt not in abtable.formats:
+        await ctx.send("Export format must be one of: " + ", ".join(abtable.formats))
+        return
+    fp = tempfile.TemporaryFile()
+    abtable.write_rows(fp, fmt, columns, rows)
+    fp.seek(0)
+    await ctx.send(file=discord.File(fp, filename="{}.{}".format(section, fmt)))
+
+convert_columns = ('fromunit', 'factor', 'tounit', 'subunit')
+
+def convert_row(row):
+    """ validate one row of a conversion import, an empty factor removes it """
+    baseunit = (row['fromunit'] or '').strip().lower()
+    if not baseunit:
+        return (None, None, "missing fromunit")
+    if row['factor'] is None:
+        return (None, None, "missing factor, leave it empty to remove the conversion")
+    factor = row['factor'].strip()
+    tounit = (row['tounit'] or '').strip()
+    subunit = (row['subunit'] or '').strip().lower() or None
+    key = convert_makekey(baseunit, subunit)
+    if not factor:
+        return (key, None, None)
+    try:
+        valid = isfloat(factor) or isexpression(factor)
+    except Exception as err:
+        return (None, None, "factor '{}' cannot be evaluated: {}".format(factor, err))
+    if not valid:
+        return (None, None, "factor must be a float or an expression manipulating x, not '{}'".format(factor))
+    if not tounit:
+        return (None, None, "missing tounit")
+    return (key, (tounit, factor, subunit), None)
+
+def convert_export(guild):
+    """ rows of the conversion table for export """
+    whole = botconfig[guild.id]['convert']
+    for key in sorted(whole):
+        (unit, sub) = convert_splitkey(key)
+        item = whole[key]
+        yield (unit, item[1], item[0], sub or '')
+
+dict_columns = ('word', 'meaning')
+
+def dict_row(row):
+    """ validate one row of a dictionary import, an empty meaning removes it """
+    keyword = (row['word'] or '').strip().lower()
+    if not keyword:
+        return (None, None, "missing word")
+    if row['meaning'] is None:
+        return (None, None, "missing meaning, leave it empty to remove the word")
+    return (keyword, row['meaning'].strip() or None, None)
+
+def dict_export(guild):
+    """ rows of the dictionary for export """
+    whole = botconfig[guild.id]['dict']
+    for keyword in sorted(whole):
+        yield (keyword, whole[keyword])
+
+class Words(commands.Cog):
+    """ .define .d .conversion and .convert """
+    def __init__(self, bot):
+        self.bot = bot
+
+    @commands.command()
+    async def convert(self, ctx, *args):
+        '''
+        Convert values between units
+        '''
+        if not perm_check(ctx, None):
+            return
+
+        response = None
+        if args and args[0] == 'list':
+            response = "Known conversions:\n"
+            whole = config_read(ctx.guild, 'convert')
+            count = 0
+            if whole:
+                whole = sorted(whole)
+            for c in whole:
+                (unit, sub) = convert_splitkey(c)
+                if count > 0:
+                    response += ","
+                response += " {}".format(unit)
+                if sub:
+                    response += " [{}]".format(sub)
+                count += 1
+
+        elif not args or args[0] == 'help' or len(args) < 2:
+            response = 'Usage: .convert {value} {unit} [subunit]\n' \
+                       '   or: .convert list\n' \
+                       '\n' \
+                       'e.g.  .convert 30 pmol/l e2\n'
+        elif not isfloat(args[0]) and ':' not in args[0]:
+            response = "Error: the first argument must be a value or time"
+        else:
+            try:
+              value = float(args[0])
+            except ValueError:
+              pass
+            baseunit = args[1].lower()
+            subunit = None
+            if len(args) > 2:
+                subunit = args[2].lower()
+            key = convert_makekey(baseunit, subunit)
+            item = config_get(ctx.guild, 'convert', key)
+            if not item:
+                response = "Sorry I don't know how to convert from {}".format(baseunit)
+                if subunit:
+                    response += " [{}]".format(subunit)
+            else:
+                destunit = item[0]
+                factor = item[1]
+                if isfloat(factor):
+                    output = value * float(factor)
+                elif isexpression(factor):
+                    output = eval(factor, {'__builtins__': {}, 'x': value})
+                else:
+                    response = "Error in conversion factor '{}'".format(factor)
+                if output:
+                    response = "{} {} is {:.2f} {}".format(value, baseunit, output, destunit)
+
+        if response:
+            await ctx.send(response)
+
+    @commands.command()
+    async def conversion(self, ctx, *args):
+        '''
+        Define a conversion
+        '''
+        if not perm_check(ctx, None):
+            return
+
+        response = None
+        if len(args)==1 and args[0] == 'list':
+            response = "Known conversions:\n"
+            whole = config_read(ctx.guild, 'convert')
+            for c in whole:
+                item = whole[c]
+                (unit, sub) = convert_splitkey(c)
+                factor = item[1]
+                if sub:
+                    response += " * {} [{}]".format(unit, sub)
+                else:
+                    response += " * {}".format(unit)
+                if isexpression(factor):
+                    response += " = {} -> {}\n".format(factor, item[0])
+                else:
+                    response += " = x * {} -> {}\n".format(factor, item[0])
+        elif args and args[0] == 'remove':
+            if len(args) < 2:
+                response = "Usage: .convert remove {fromunit} [subunit]"
+            else:
+                baseunit = args[1].lower()
+                subunit = None
+                if len(args) > 2:
+                    subunit = args[2].lower()
+                key = convert_makekey(baseunit, subunit)
+                response = "conversion for {}".format(baseunit)
+                if subunit:
+                    response += " [{}]".format(subunit)
+                if not config_get(ctx.guild, 'convert', key):
+                    response += " not found"
+                else:
+                    config_set(ctx.guild, 'convert', key, None)
+                    response += " deleted"
+        elif args and args[0] == 'import' and len(args) == 1:
+            response = await bulk_import(ctx, 'convert', convert_columns, convert_row)
+        elif args and args[0] == 'export' and len(args) <= 2 and (len(args) == 1 or args[1].lower() in abtable.formats):
+            await bulk_export(ctx, 'convert', convert_columns, args, convert_export(ctx.guild))
+        elif not args or args[0] == 'help' or len(args) < 3:
+            response = 'Usage: .conversion {fromunit} {factor/formula} {tounit} [subunit]\n' \
+                       '   or: .conversion list\n' \
+                       '   or: .conversion remove {fromunit} [subunit]\n' \
+                       '   or: .conversion import  (with a .csv or .json file attached)\n' \
+                       '   or: .conversion export [csv|json]\n' \
+                       '\n' \
+                       'e.g.  .conversion pmol/l 3.671 pg/ml e2\n' \
+                       '      .conversion celsius "((x-32)*5)/9" fahrenheit'
+        else:
+            baseunit = args[0].lower()
+            factor = args[1]
+            tounit = args[2]
+            subunit = None
+            if len(args) > 3:
+                subunit = args[3].lower()
+
+            if not isfloat(factor) and not isexpression(factor):
+                response = "Factor must be a float or an expression manipulating x.  e.g. '((x-32)*5/9' instead of '%s'" % factor
+            else:
+                response = "Convert {}".format(baseunit)
+                if subunit:
+                    response += " [{}]".format(subunit)
+                response += " into {} with {}".format(tounit, factor)
+
+                key = convert_makekey(baseunit, subunit)
+                config_set(ctx.guild, 'convert', key, (tounit, factor, subunit))
+
+        if response:
+            await ctx.send(response)
+
+
+    @commands.command()
+    async def define(self, ctx, *args):
+        '''
+        Define a word
+        '''
+        if not perm_check(ctx, None):
+            return
+
+        response = None
+        if not args or args[0] == 'help':
+            response = 'Usage: .define word Text of definition....\n' \
+                       '   or: .define import  (with a .csv or .json file attached)\n' \
+                       '   or: .define export [csv|json]'
+        elif args[0] == 'import' and len(args) == 1:
+            response = await bulk_import(ctx, 'dict', dict_columns, dict_row)
+        elif args[0] == 'export' and len(args) <= 2 and (len(args) == 1 or args[1].lower() in abtable.formats):
+            await bulk_export(ctx, 'dict', dict_columns, args, dict_export(ctx.guild))
+        else:
+            keyword = args[0].lower()
+            rest = args[1:]
+            u = ctx.author
+            c = config_get(ctx.guild, 'dict', keyword)
+
+            if not rest:
+                if not c:
+                    response = 'No dictionary entry for "' + keyword + '"'
+                else:
+                    response = "Removed definition of '"+keyword+"'"
+                    config_set(ctx.guild, 'dict', keyword, None)
+            else:
+                text = " ".join(rest)
+                config_set(ctx.guild, 'dict', keyword, text)
+                response = "Defined '"+keyword+"' as '"+text+"'"
+
+        if response:
+            await ctx.send(response)
+
+    @commands.command()
+    async def d(self, ctx, *args):
+        '''
+        Print a word definition
+        '''
+        if not perm_check(ctx, None):
+            return
+
+        response = None
+        if not args or args[0] == 'help':
+            response = 'Usage: '+abconfig.prefix+'d word\nPrints the definitionof the given word.'
+        elif args[0] == 'list':
+            response = "Known dictionary words: "
+            whole = config_read(ctx.guild, 'dict')
+            response += ", ".join(whole.keys())
+        else:
+            keyword = args[0].lower()
+            u = ctx.author
+            c = config_get(ctx.guild, 'dict', keyword)
+
+            if not c:
+                response = 'No dictionary entry for "' + keyword + '"'
+            else:
+                response = keyword + " -> " + c
+
+        if response:
+            await ctx.send(response)
+
+async def setup(bot):
+    await bot.add_cog(Words(bot))